@@ -2,19 +2,28 @@
 """A collection of Vapoursynth functions and wrappers."""
 
 from collections.abc import Callable, Iterable
-from dataclasses import _DataclassT, dataclass, field, replace
-from functools import partial
+from copy import deepcopy
+from dataclasses import dataclass, field, replace
+from functools import cache, cached_property, partial
+from operator import attrgetter, gt
 from pathlib import Path, PurePath
 from shutil import which
-from typing import Any, NamedTuple
+from stat import S_ISREG
+from types import MappingProxyType
+from typing import Any, NamedTuple, cast
 
 import havsfunc as hav
 import insane_aa as iaa
 import kagefunc as kg
 import vapoursynth as vs
 from vstools import FrameRange, FrameRangeN, FrameRangesN, replace_ranges
-from vsutil import depth, get_depth, get_y, iterate, join, split
-from yaml import safe_load
+from vsutil import depth, get_depth, get_y, iterate, join, plane, split
+from yaml import load
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader
 
 type Maps = FrameRangeN | FrameRangesN
 """Maps type alias."""
@@ -24,6 +33,12 @@ type VideoFunc = Callable[..., vs.VideoNode]
 PROC_DEPTH = 16
 """The processing depth."""
 
+_YAML_CACHE: dict[Path, tuple[int, int, dict | None]] = {}
+"""Parsed yaml files keyed by resolved path, with the mtime and size they were parsed at."""
+
+_OVERRIDE_CACHE: dict[tuple[Any, ...], tuple[dict | None, Any]] = {}
+"""Resolved settings keyed by defaults, block, zone and overrides; invalidated by yaml reloads."""
+
 
 def load_yaml(file_path: str) -> dict | None:
     """Load yaml settings from a file.
@@ -34,17 +49,40 @@ def load_yaml(file_path: str) -> dict | None:
     Returns:
         The loaded YAML settings as a dictionary, or None if the file does not exist.
     """
+    return deepcopy(_load_yaml(file_path))
+
+
+def _load_yaml(file_path: str) -> dict | None:
+    """Same as `load_yaml`, but returns the shared cached dict, which must not be mutated."""
     f1 = Path(file_path)
 
-    return safe_load(f1.read_text()) if f1.is_file() else None
+    try:
+        st = f1.stat()
+    except FileNotFoundError:
+        return None
+
+    if not S_ISREG(st.st_mode):
+        return None
 
+    path = f1.resolve()
+    entry = _YAML_CACHE.get(path)
+
+    if entry is None or entry[:2] != (st.st_mtime_ns, st.st_size):
+        entry = _YAML_CACHE[path] = (
+            st.st_mtime_ns,
+            st.st_size,
+            load(f1.read_text(), Loader=SafeLoader),
+        )
 
-def override_dc(
-    data_class: _DataclassT,
+    return entry[2]
+
+
+def override_dc[T](
+    data_class: T,
     block: str,
     zone: str = "",
     **override: Any,
-) -> _DataclassT:
+) -> T:
     """Override default data_class params.
 
     Notes:
@@ -63,21 +101,99 @@ def override_dc(
     Returns:
         The data class object with overridden parameters.
     """
-    settings = load_yaml("./settings.yaml")
+    settings = _load_yaml("./settings.yaml")
+
+    try:
+        key = (
+            type(data_class),
+            data_class,
+            block,
+            zone,
+            frozenset((name, type(val), val) for name, val in override.items()),
+        )
+        entry = _OVERRIDE_CACHE.get(key)
+    except TypeError:
+        # unhashable (mutable) settings or override values are not cached
+        return _override_dc(data_class, settings, block, zone, override)
+
+    if entry is None or entry[0] is not settings:
+        entry = _OVERRIDE_CACHE[key] = (
+            settings,
+            _override_dc(data_class, settings, block, zone, override),
+        )
+
+    return entry[1]
+
+
+def _override_dc[T](
+    data_class: T,
+    settings: dict | None,
+    block: str,
+    zone: str,
+    override: dict[str, Any],
+) -> T:
+    changes: dict[str, Any] = {}
 
     if settings is not None:
         block_settings = settings.get(block)
 
         if block_settings is not None:
             # yaml main
-            data_class = replace(data_class, **block_settings["main"])
+            changes.update(block_settings["main"])
 
             if zone and zone != "main":
                 # yaml zone
-                data_class = replace(data_class, **block_settings[zone])
+                changes.update(block_settings[zone])
 
     # func params
-    return replace(data_class, **override)
+    changes.update(override)
+
+    if not changes:
+        return data_class
+
+    # NamedTuple settings
+    if isinstance(data_class, tuple):
+        return cast("Any", data_class)._replace(**changes)
+
+    return replace(cast("Any", data_class), **changes)
+
+
+def _expr(
+    clips: vs.VideoNode | list[vs.VideoNode],
+    expr: str | list[str],
+    **kwargs: Any,
+) -> vs.VideoNode:
+    """Evaluate an expression with `akarin.Expr` when available, `std.Expr` otherwise.
+
+    Args:
+        clips: Input clip(s).
+        expr: The expression(s) to evaluate.
+        **kwargs: Additional arguments passed to Expr (e.g. `format`).
+
+    Returns:
+        The evaluated clip.
+    """
+    core = vs.core
+
+    return (core.akarin if hasattr(core, "akarin") else core.std).Expr(clips, expr, **kwargs)
+
+
+def _replace_plane(clip: vs.VideoNode, new_plane: vs.VideoNode, idx: int) -> vs.VideoNode:
+    """Replace a single plane of `clip` with one ShufflePlanes node instead of split/join."""
+    return vs.core.std.ShufflePlanes(
+        [new_plane if i == idx else clip for i in range(3)],
+        planes=[0 if i == idx else i for i in range(3)],
+        colorfamily=clip.format.color_family,
+    )
+
+
+def _replace_chroma(clip: vs.VideoNode, u: vs.VideoNode, v: vs.VideoNode) -> vs.VideoNode:
+    """Swap both chroma planes of `clip` with one ShufflePlanes node instead of split/join."""
+    return vs.core.std.ShufflePlanes(
+        [clip, u, v],
+        planes=[0, 0, 0],
+        colorfamily=clip.format.color_family,
+    )
 
 
 ######
@@ -93,6 +209,13 @@ class NumFramesError(Exception):
     """
 
 
+def _check_num_frames(**clips: vs.VideoNode) -> None:
+    """Raise `NumFramesError` unless all clips have the same length."""
+    if len({clip.num_frames for clip in clips.values()}) > 1:
+        msg = ", ".join(f"{name}.num_frames={clip.num_frames}" for name, clip in clips.items())
+        raise NumFramesError(msg)
+
+
 class Edi3Mode(NamedTuple):
     """Represents the configuration for eedi3/nnedi3.
 
@@ -107,9 +230,12 @@ class Edi3Mode(NamedTuple):
     nnedi3_mode: iaa.NNEDI3Mode
 
 
+@cache
 def get_edi3_mode() -> Edi3Mode:
     """Returns the Edi3Mode based on the availability of the `nvidia-smi` command.
 
+    The lookup is done once per process.
+
     Returns:
         The Edi3Mode based on the availability of `nvidia-smi`.
     """
@@ -127,8 +253,7 @@ def get_edi3_mode() -> Edi3Mode:
     )
 
 
-@dataclass(frozen=True)
-class AASettings:
+class AASettings(NamedTuple):
     desc_h: int = 0
     desc_str: float = 0.32
     kernel: str = "bicubic"
@@ -194,20 +319,16 @@ def aa_yuv(clip: vs.VideoNode, aaset: AASettings) -> vs.VideoNode:
         desc_str=aaset.desc_str,
         desc_h=aaset.desc_h,
     )
-    planes[1] = insane_aa(
-        clip=planes[1],
-        aaset=aaset,
-        out_mode=iaa.ClipMode.MASKED,
-        desc_str=aaset.uv_desc_str,
-        desc_h=aaset.uv_desc_h,
-    )
-    planes[2] = insane_aa(
-        clip=planes[2],
+
+    uv_aa = partial(
+        insane_aa,
         aaset=aaset,
         out_mode=iaa.ClipMode.MASKED,
         desc_str=aaset.uv_desc_str,
         desc_h=aaset.uv_desc_h,
     )
+    planes[1] = uv_aa(planes[1])
+    planes[2] = uv_aa(planes[2])
 
     return join(planes)
 
@@ -236,9 +357,7 @@ def aa(
         if f1.is_file():
             aa_lossless = source(f1)
 
-            if aa_lossless.num_frames != clip.num_frames:
-                msg = f"{aa_lossless.num_frames=}, {clip.num_frames=}"
-                raise NumFramesError(msg)
+            _check_num_frames(aa_lossless=aa_lossless, clip=clip)
 
             return aa_lossless
 
@@ -259,14 +378,11 @@ def aa(
 
 
 def diff_mask(clipa: vs.VideoNode, clipb: vs.VideoNode, mthr: int = 25) -> vs.VideoNode:
-    return (
-        vs.core.std.MakeDiff(clipa=get_y(clipa), clipb=get_y(clipb), planes=[0])
-        .std.Prewitt()
-        .std.Expr(f"x {mthr} < 0 x ?")
-        .std.Convolution([1] * 9)
-        .std.Convolution([1] * 9)
-        .std.Expr("x 8 - 2.2 *")
-    )
+    diff = vs.core.std.MakeDiff(clipa=get_y(clipa), clipb=get_y(clipb), planes=[0]).std.Prewitt()
+    # two 3x3 box blurs == one separable [1, 2, 3, 2, 1] pass
+    blurred = _expr(diff, f"x {mthr} < 0 x ?").std.Convolution([1, 2, 3, 2, 1], mode="hv")
+
+    return _expr(blurred, "x 8 - 2.2 *")
 
 
 def save_titles(
@@ -275,17 +391,17 @@ def save_titles(
     ncoped_aa: vs.VideoNode,
 ) -> vs.VideoNode:
     """Save OP/ED titles with expr and diff_mask."""
-    oped_planes = split(oped_clip)
+    fmt = oped_clip.format
+    peak = 1 if fmt.sample_type == vs.FLOAT else (1 << fmt.bits_per_sample) - 1
+    mask = diff_mask(oped_clip, ncoped)
 
-    oped_planes[0] = vs.core.std.Expr(
-        [oped_planes[0], get_y(ncoped), get_y(ncoped_aa)],
-        ["x y - z +"],
+    # MaskedMerge(clamp(x - y + z), x, a) in a single pass
+    oped_y = _expr(
+        [get_y(oped_clip), get_y(ncoped), get_y(ncoped_aa), mask],
+        [f"x y - z + 0 max {peak} min {peak} a - * x a * + {peak} /"],
     )
 
-    saved_titles = join(oped_planes)
-    mask = diff_mask(oped_clip, ncoped)
-
-    return masked_merge(saved_titles, oped_clip, mask=mask, yuv=False)
+    return _replace_plane(oped_clip, oped_y, 0)
 
 
 def oped(
@@ -326,9 +442,7 @@ def oped(
             source(f2).std.Trim(offset, ncoped_end) if f2.is_file() else filtr(ncoped_aa, ncoped)
         )
 
-    if not (oped_clip.num_frames == ncoped.num_frames == ncoped_aa.num_frames):
-        msg = f"{oped_clip.num_frames=}, {ncoped.num_frames=}, {ncoped_aa.num_frames=}"
-        raise NumFramesError(msg)
+    _check_num_frames(oped_clip=oped_clip, ncoped=ncoped, ncoped_aa=ncoped_aa)
 
     return save_titles(oped_clip=oped_clip, ncoped=ncoped, ncoped_aa=ncoped_aa)
 
@@ -350,11 +464,11 @@ def gradfun_mask(source: vs.VideoNode, thr_det: float = 1, mode: int = 3) -> vs.
     mexpr = f"x {tl} - {th} {tl} - / 255 *"
 
     if mode > 0:
-        deband_mask = gf3_range_mask(src_8, radius=mode).std.Expr(mexpr).rgvs.RemoveGrain(22)
+        deband_mask = _expr(gf3_range_mask(src_8, radius=mode), mexpr).rgvs.RemoveGrain(22)
         if mode > 1:
-            deband_mask = deband_mask.std.Convolution([1, 2, 1, 2, 4, 2, 1, 2, 1])
+            deband_mask = deband_mask.std.Convolution([1, 2, 1], mode="hv")
             if mode > 2:
-                deband_mask = deband_mask.std.Convolution([1] * 9)
+                deband_mask = deband_mask.std.Convolution([1, 1, 1], mode="hv")
 
         return depth(deband_mask, PROC_DEPTH)
 
@@ -395,7 +509,7 @@ def adaptive_debandmask(
         )
 
     if db_expr:
-        db_mask = db_mask.std.Expr(db_expr)
+        db_mask = _expr(db_mask, db_expr)
 
     return db_mask
 
@@ -419,20 +533,20 @@ def save_uv_unique_lines(
     mode: str = "retinex",
     sigma: float = 1.0,
 ) -> vs.VideoNode:
-    clip_planes = split(clip)
-    src_planes = split(source)
+    src_u = plane(source, 1)
+    src_v = plane(source, 2)
 
     if mode == "retinex":
-        mask_u = kg.retinex_edgemask(src_planes[1], sigma=sigma)
-        mask_v = kg.retinex_edgemask(src_planes[2], sigma=sigma)
+        mask_u = kg.retinex_edgemask(src_u, sigma=sigma)
+        mask_v = kg.retinex_edgemask(src_v, sigma=sigma)
     elif mode == "kirsch":
-        mask_u = edge_detect(src_planes[1], mode="kirsch")
-        mask_v = edge_detect(src_planes[2], mode="kirsch")
+        mask_u = edge_detect(src_u, mode="kirsch")
+        mask_v = edge_detect(src_v, mode="kirsch")
 
-    fix_u = masked_merge(clip_planes[1], src_planes[1], mask_u)
-    fix_v = masked_merge(clip_planes[2], src_planes[2], mask_v)
+    fix_u = masked_merge(plane(clip, 1), src_u, mask_u)
+    fix_v = masked_merge(plane(clip, 2), src_v, mask_v)
 
-    return join([clip_planes[0], fix_u, fix_v])
+    return _replace_chroma(clip, fix_u, fix_v)
 
 
 def save_black(
@@ -441,6 +555,11 @@ def save_black(
     threshold: float = 0.06276,
 ) -> vs.VideoNode:
     """Return filtered when avg exceeds the threshold."""
+    stats = vs.core.std.PlaneStats(clip)
+
+    if hasattr(vs.core, "akarin"):
+        # per-frame switch inside the graph, no python callback
+        return vs.core.akarin.Select([clip, filtered], stats, f"x.PlaneStatsAverage {threshold} >")
 
     def _diff(
         n: int,  # noqa: ARG001
@@ -454,10 +573,22 @@ def save_black(
     return vs.core.std.FrameEval(
         clip=clip,
         eval=partial(_diff, clip=clip, filtered=filtered, threshold=threshold),
-        prop_src=vs.core.std.PlaneStats(clip),
+        prop_src=stats,
     )
 
 
+_F3KDB_ARGS = MappingProxyType(
+    {
+        "dither_algo": 3,
+        "blur_first": True,
+        "dynamic_grain": False,
+        "keep_tv_range": True,
+        "output_depth": PROC_DEPTH,
+    }
+)
+"""Static f3kdb arguments shared by every `f3kdb_deband` call."""
+
+
 def f3kdb_deband(
     clip: vs.VideoNode,
     det_y: int,
@@ -469,16 +600,12 @@ def f3kdb_deband(
     return vs.core.f3kdb.Deband(
         clip=clip,
         range=drange,
-        dither_algo=3,
         y=det_y,
         cb=det_y if yuv else 0,
         cr=det_y if yuv else 0,
-        blur_first=True,
         grainy=grainy,
         grainc=grainy / 2 if yuv else 0,
-        dynamic_grain=False,
-        keep_tv_range=True,
-        output_depth=PROC_DEPTH,
+        **_F3KDB_ARGS,
     )
 
 
@@ -498,7 +625,7 @@ def contrasharp(
         edgemask=cs_mask,
         thSAD=sm_thr,
     )
-    clip_expr = vs.core.std.Expr([contrasharped, clip], f"x {cs_val} * y 1 {cs_val} - * +")
+    clip_expr = _expr([contrasharped, clip], f"x {cs_val} * y 1 {cs_val} - * +")
 
     return (clip_expr, contrasharped)
 
@@ -507,41 +634,96 @@ def _out_mask(mask: vs.VideoNode) -> vs.VideoNode:
     return vs.core.resize.Point(mask, format=vs.YUV420P10, matrix_s="709")
 
 
-def smdegrain_(clip: vs.VideoNode, sm_thr: int = 48, sm_pref_mode: int = 1) -> vs.VideoNode:
-    sm_set = {
-        "prefilter": sm_pref_mode,
-        "tr": 4,
-        "RefineMotion": True,
-        "contrasharp": False,
-    }
+def _square_window(clip: vs.VideoNode, radius: int, op: str, step: VideoFunc) -> vs.VideoNode:
+    """Same as `radius` passes of a 3x3 `step`, done as one square `op` window with akarin."""
+    if radius < 2 or not hasattr(vs.core, "akarin"):
+        return iterate(clip, function=step, count=radius)
+
+    offsets = range(-radius, radius + 1)
+    pixels = [f"x[{dx},{dy}]" for dy in offsets for dx in offsets]
+
+    return vs.core.akarin.Expr(clip, " ".join(pixels) + f" {op}" * (len(pixels) - 1))
+
+
+def _expand(clip: vs.VideoNode, radius: int = 1) -> vs.VideoNode:
+    return _square_window(clip, radius, op="max", step=vs.core.std.Maximum)
 
+
+def _inpand(clip: vs.VideoNode, radius: int = 1) -> vs.VideoNode:
+    return _square_window(clip, radius, op="min", step=vs.core.std.Minimum)
+
+
+def _mask_smooth(mask: vs.VideoNode, radius: int = 1) -> vs.VideoNode:
+    """Smooth a mask with `radius` passes of a separable [1, 2, 1] blur."""
+    return iterate(
+        mask,
+        function=partial(vs.core.std.Convolution, matrix=[1, 2, 1], mode="hv"),
+        count=radius,
+    )
+
+
+_SMDEGRAIN_ARGS = MappingProxyType({"tr": 4, "RefineMotion": True, "contrasharp": False})
+"""Static SMDegrain arguments shared by every `smdegrain_` call."""
+
+
+def smdegrain_(clip: vs.VideoNode, sm_thr: int = 48, sm_pref_mode: int = 1) -> vs.VideoNode:
     if isinstance(sm_thr, int):
-        return hav.SMDegrain(clip, thSAD=sm_thr, plane=4, chroma=True, **sm_set)
+        return hav.SMDegrain(
+            clip, thSAD=sm_thr, plane=4, chroma=True, prefilter=sm_pref_mode, **_SMDEGRAIN_ARGS
+        )
 
     if isinstance(sm_thr, list):
-        while len(sm_thr) < 3:
-            sm_thr.append(sm_thr[len(sm_thr) - 1])
+        # pad without mutating the list, it may come from the cached yaml settings
+        sm_thr = [*sm_thr, *[sm_thr[-1]] * (3 - len(sm_thr))]
 
         if clip.format.num_planes == 1:
-            return hav.SMDegrain(clip, thSAD=sm_thr[0], **sm_set)
+            return hav.SMDegrain(clip, thSAD=sm_thr[0], prefilter=sm_pref_mode, **_SMDEGRAIN_ARGS)
 
         planes = split(clip)
 
-        planes[0] = hav.SMDegrain(planes[0], thSAD=sm_thr[0], **sm_set)
-        planes[1] = hav.SMDegrain(planes[1], thSAD=sm_thr[1], **sm_set)
-        planes[2] = hav.SMDegrain(planes[2], thSAD=sm_thr[2], **sm_set)
+        planes[0] = hav.SMDegrain(
+            planes[0], thSAD=sm_thr[0], prefilter=sm_pref_mode, **_SMDEGRAIN_ARGS
+        )
+        planes[1] = hav.SMDegrain(
+            planes[1], thSAD=sm_thr[1], prefilter=sm_pref_mode, **_SMDEGRAIN_ARGS
+        )
+        planes[2] = hav.SMDegrain(
+            planes[2], thSAD=sm_thr[2], prefilter=sm_pref_mode, **_SMDEGRAIN_ARGS
+        )
 
         return join(planes)
 
     return None
 
 
+def _bm3d_cuda(clip: vs.VideoNode, sigma: float, radius1: float) -> vs.VideoNode:
+    """Two-step BM3D (basic + final estimate) on the GPU."""
+    src = depth(clip, 32)
+
+    basic = src.bm3dcuda.BM3Dv2(sigma=sigma, radius=int(radius1))
+    final = src.bm3dcuda.BM3Dv2(ref=basic, sigma=sigma, radius=int(radius1))
+
+    return depth(final, get_depth(clip))
+
+
+def _bm3d_backend(cuda: bool = False) -> VideoFunc:
+    """Returns `bm3dcuda` when `cuda` is set, `mvsfunc.BM3D` otherwise."""
+    if cuda:
+        return _bm3d_cuda
+
+    from mvsfunc import BM3D
+
+    return BM3D
+
+
 def bm3d_(
     clip: vs.VideoNode,
     bm_sigma: float = 2,
     bm_radius: float = 1,
     sm_thr: int = 48,
     sm_pref_mode: int = 1,
+    *,
+    cuda: bool = False,
 ) -> vs.VideoNode:
     """Apply BM3D denoising to the input clip.
 
@@ -551,33 +733,34 @@ def bm3d_(
         bm_radius: Radius parameter for BM3D.
         sm_thr: Threshold parameter for smdegrain.
         sm_pref_mode: Prefilter mode for smdegrain.
+        cuda: Denoise luma with `bm3dcuda` on the GPU. Its strength is only similar to the CPU
+            BM3D, so the output differs slightly.
 
     Returns:
         Denoised video clip.
     """
-    from mvsfunc import BM3D
-
     planes = split(clip)
 
-    planes[0] = BM3D(planes[0], sigma=bm_sigma, radius1=bm_radius)
+    planes[0] = _bm3d_backend(cuda)(planes[0], sigma=bm_sigma, radius1=bm_radius)
     planes[1] = smdegrain_(planes[1], sm_thr=sm_thr, sm_pref_mode=sm_pref_mode)
     planes[2] = smdegrain_(planes[2], sm_thr=sm_thr, sm_pref_mode=sm_pref_mode)
 
     return join(planes)
 
 
-@dataclass(frozen=True)
-class FilterSettings:
+class FilterSettings(NamedTuple):
     rt_sigma: float = 1.0
     dn_mode: str = "smdegrain"
     dn_ttsmooth: bool = False
     bm_sigma: float = 2.0
     bm_radius: int = 1
+    bm_cuda: bool = False
     sm_thr: int = 40
     sm_pref_mode: int = 1
     dn_pref: bool = False
     dn_pref_scaling: float = 0.0
     dn_pref_mul: int = 0
+    dn_pref_blur: int = 0  # > 0: smooth rt_mask_denoised_x2 with blur passes, not SMDegrain
     dn_save_uv: bool = False
     dn_adaptive: dict | None = None
     dn_expr: str = ""
@@ -603,245 +786,372 @@ class FilterSettings:
     ag_saveblack_tolerance: int = 2
 
 
-def filt(  # noqa: PLR0911, PLR0912, PLR0915, C901
-    mrgc: vs.VideoNode,
-    zone: str = "",
-    out_mode: int = 0,
-    prefilt_func: VideoFunc | None = None,
-    **override: Any,
-) -> vs.VideoNode:
-    """Apply various filters and denoising techniques to the input video clip.
+_FILT_OUT_MASKS = {
+    1: "ag_mask",
+    2: "db_mask_gradfun",
+    3: "db_mask",
+    4: "rt_mask_clip16",
+    5: "rt_mask_mix",
+    6: "rt_mask_denoised",
+    7: "rt_mask_denoised_x2",
+}
+"""Mask nodes returned by `filt` for each non-zero out_mode."""
 
-    Args:
-        mrgc: The input video clip.
-        zone: The zone to apply the filters to.
-        out_mode: The output mode.
-        prefilt_func: The pre-filter function.
-        **override: Additional parameters to override the default filter settings.
 
-    Returns:
-        The filtered video clip.
-    """
-    fset = FilterSettings()
-    fset = override_dc(fset, block="filt", zone=zone, **override)
+@dataclass
+class _FiltGraph:
+    """Lazily built `filt` graph: every node is constructed only when something consumes it."""
 
-    clip16 = depth(mrgc, PROC_DEPTH)
+    mrgc: vs.VideoNode
+    clip16: vs.VideoNode
+    fset: FilterSettings
 
-    if prefilt_func:
-        clip16 = prefilt_func(mrgc, clip16)
+    @cached_property
+    def rt_mask_clip16(self: "_FiltGraph") -> vs.VideoNode:
+        return kg.retinex_edgemask(src=self.clip16, sigma=self.fset.rt_sigma)
 
-    rt_mask_clip16 = kg.retinex_edgemask(src=clip16, sigma=fset.rt_sigma)
+    @cached_property
+    def src_denoise(self: "_FiltGraph") -> vs.VideoNode:
+        if not self.fset.dn_ttsmooth:
+            return self.clip16
 
-    if fset.dn_mode is None:
-        denoised = clip16
-    else:
-        # dn_ttsmooth
-        if fset.dn_ttsmooth:
-            ttsmooth_set = {"thresh": 1, "mdiff": 0, "strength": 1}
+        ttsmooth_set = {"thresh": 1, "mdiff": 0, "strength": 1}
 
-            ttmpsm = clip16.ttmpsm.TTempSmooth(maxr=7, fp=True, **ttsmooth_set)
-            src_denoise = masked_merge(ttmpsm, clip16, mask=rt_mask_clip16, yuv=True)
-        else:
-            src_denoise = clip16
+        ttmpsm = self.clip16.ttmpsm.TTempSmooth(maxr=7, fp=True, **ttsmooth_set)
+        return masked_merge(ttmpsm, self.clip16, mask=self.rt_mask_clip16, yuv=True)
+
+    @cached_property
+    def full_denoise(self: "_FiltGraph") -> vs.VideoNode:
+        fset = self.fset
 
-        # denoised
         if fset.dn_mode == "smdegrain":
             full_denoise = smdegrain_(
-                clip=src_denoise,
+                clip=self.src_denoise,
                 sm_thr=fset.sm_thr,
                 sm_pref_mode=fset.sm_pref_mode,
             )
             if fset.dn_adaptive is not None:
                 full_denoise = adaptive_smdegrain(
-                    clip=clip16,
+                    clip=self.clip16,
                     smdegrain=full_denoise,
                     yaml=fset.dn_adaptive,
                 )
+            return full_denoise
 
-        elif fset.dn_mode == "bm3d":
-            full_denoise = bm3d_(
-                src_denoise,
+        if fset.dn_mode == "bm3d":
+            return bm3d_(
+                self.src_denoise,
                 bm_sigma=fset.bm_sigma,
                 bm_radius=fset.bm_radius,
                 sm_thr=fset.sm_thr,
                 sm_pref_mode=fset.sm_pref_mode,
+                cuda=fset.bm_cuda,
             )
 
-        denoised = masked_merge(full_denoise, clip16, mask=rt_mask_clip16, yuv=True)
+        if fset.dn_mode is None:
+            return self.clip16
 
-        # dn_pref
-        if fset.dn_pref or fset.cs_mode:
-            rt_mask_denoised = kg.retinex_edgemask(denoised, sigma=fset.rt_sigma)
+        msg = f"unknown dn_mode: {fset.dn_mode!r}"
+        raise ValueError(msg)
 
-            if fset.dn_expr:
-                rt_mask_denoised_def = rt_mask_denoised
-                rt_mask_denoised = rt_mask_denoised.std.Expr(fset.dn_expr)
+    @cached_property
+    def denoised_merged(self: "_FiltGraph") -> vs.VideoNode:
+        return masked_merge(self.full_denoise, self.clip16, mask=self.rt_mask_clip16, yuv=True)
 
-            rt_mask_mix = (
-                adaptive_mix(
-                    clip=clip16,
-                    f1=rt_mask_clip16,
-                    f2=rt_mask_denoised,
-                    scaling=fset.dn_pref_scaling,
-                    yuv=False,
-                )
-                if fset.dn_pref_scaling
-                else rt_mask_denoised
-            )
+    @cached_property
+    def rt_mask_denoised_def(self: "_FiltGraph") -> vs.VideoNode:
+        return kg.retinex_edgemask(src=self.denoised_merged, sigma=self.fset.rt_sigma)
 
-            if fset.dn_pref_mul:
-                rt_mask_denoised_x2 = smdegrain_(
-                    clip=rt_mask_denoised,
-                    sm_thr=fset.sm_thr * fset.dn_pref_mul,
-                    sm_pref_mode=fset.sm_pref_mode,
-                )
-                if fset.db_rt_mode == 4 and fset.db_adaptive is not None:
-                    rt_mask_denoised_mix = adaptive_mix(
-                        clip=clip16,
-                        f1=rt_mask_denoised,
-                        f2=rt_mask_denoised_x2,
-                        scaling=fset.db_adaptive["z2"]["scaling"],
-                        yuv=False,
-                    )
-
-            if fset.dn_pref or fset.db_gf_mode == 3:
-                denoised_pref = masked_merge(full_denoise, clip16, mask=rt_mask_mix, yuv=True)
-
-        if fset.dn_pref:
-            denoised = denoised_pref
-
-        # dn_save_uv
-        if fset.dn_save_uv:
-            denoised = save_uv_unique_lines(clip=denoised, source=clip16, sigma=fset.rt_sigma)
-
-        # contrasharp
-        if fset.cs_mode:
-            if fset.cs_mode == 1:  # default
-                cs_mask = rt_mask_denoised
-            elif fset.cs_mode == 2:
-                cs_mask = rt_mask_denoised_x2
-            elif fset.cs_mode == 3:
-                cs_mask = rt_mask_mix
-            elif fset.cs_mode == 4:
-                cs_mask = rt_mask_denoised_def
-
-            denoised_expr, denoised_fullcs = contrasharp(
-                clip=denoised,
-                source=clip16,
-                cs_mask=cs_mask,
-                sm_thr=fset.sm_thr,
-                cs_val=fset.cs_val,
-            )
-            if not fset.cs_merge:
-                denoised = denoised_expr
-            else:
-                if fset.cs_merge == 1:
-                    cs_mask_merge = cs_mask
-                elif fset.cs_merge == 2:
-                    cs_mask_merge = cs_mask.std.Inflate()
-                denoised = masked_merge(denoised, denoised_expr, mask=cs_mask_merge, yuv=True)
-
-    if fset.db_thr == 0:
-        debanded = denoised
-    else:
-        debanded = f3kdb_deband(
-            clip=denoised,
-            det_y=fset.db_det,
-            grainy=fset.db_grain,
-            drange=fset.db_range,
-            yuv=fset.db_yuv,
+    @cached_property
+    def rt_mask_denoised(self: "_FiltGraph") -> vs.VideoNode:
+        if self.fset.dn_expr:
+            return _expr(self.rt_mask_denoised_def, self.fset.dn_expr)
+
+        return self.rt_mask_denoised_def
+
+    @cached_property
+    def rt_mask_mix(self: "_FiltGraph") -> vs.VideoNode:
+        if not self.fset.dn_pref_scaling:
+            return self.rt_mask_denoised
+
+        return adaptive_mix(
+            clip=self.clip16,
+            f1=self.rt_mask_clip16,
+            f2=self.rt_mask_denoised,
+            scaling=self.fset.dn_pref_scaling,
+            yuv=False,
+        )
+
+    @cached_property
+    def rt_mask_denoised_x2(self: "_FiltGraph") -> vs.VideoNode:
+        fset = self.fset
+
+        if fset.dn_pref_blur:
+            return _mask_smooth(self.rt_mask_denoised, radius=fset.dn_pref_blur)
+
+        if not fset.dn_pref_mul:
+            msg = "rt_mask_denoised_x2 requires dn_pref_mul or dn_pref_blur settings"
+            raise ValueError(msg)
+
+        return smdegrain_(
+            self.rt_mask_denoised,
+            sm_thr=fset.sm_thr * fset.dn_pref_mul,
+            sm_pref_mode=fset.sm_pref_mode,
+        )
+
+    @cached_property
+    def rt_mask_denoised_mix(self: "_FiltGraph") -> vs.VideoNode:
+        if self.fset.db_adaptive is None:
+            msg = "db_rt_mode=4 requires db_adaptive settings"
+            raise ValueError(msg)
+
+        return adaptive_mix(
+            clip=self.clip16,
+            f1=self.rt_mask_denoised,
+            f2=self.rt_mask_denoised_x2,
+            scaling=self.fset.db_adaptive["z2"]["scaling"],
+            yuv=False,
         )
-        if fset.db_gf_mode == 1:
-            gradfun_src = denoised_fullcs
-        elif fset.db_gf_mode == 2:  # default
-            gradfun_src = denoised
-        elif fset.db_gf_mode == 3:
-            gradfun_src = denoised_pref
-        elif fset.db_gf_mode == 4:
-            gradfun_src = full_denoise
 
-        db_mask = gradfun_mask(source=gradfun_src, thr_det=fset.db_thr, mode=fset.db_mode)
+    @cached_property
+    def denoised_pref(self: "_FiltGraph") -> vs.VideoNode:
+        return masked_merge(self.full_denoise, self.clip16, mask=self.rt_mask_mix, yuv=True)
+
+    @cached_property
+    def denoised_uv(self: "_FiltGraph") -> vs.VideoNode:
+        denoised = self.denoised_pref if self.fset.dn_pref else self.denoised_merged
+
+        if self.fset.dn_save_uv:
+            return save_uv_unique_lines(denoised, source=self.clip16, sigma=self.fset.rt_sigma)
+
+        return denoised
+
+    @cached_property
+    def cs_mask(self: "_FiltGraph") -> vs.VideoNode:
+        cs_masks = {
+            1: "rt_mask_denoised",  # default
+            2: "rt_mask_denoised_x2",
+            3: "rt_mask_mix",
+            4: "rt_mask_denoised_def",
+        }
+        return getattr(self, cs_masks[self.fset.cs_mode])
+
+    @cached_property
+    def contrasharped(self: "_FiltGraph") -> tuple[vs.VideoNode, vs.VideoNode]:
+        return contrasharp(
+            clip=self.denoised_uv,
+            source=self.clip16,
+            cs_mask=self.cs_mask,
+            sm_thr=self.fset.sm_thr,
+            cs_val=self.fset.cs_val,
+        )
 
-        if out_mode == 2:
-            db_mask_gradfun = db_mask
+    @cached_property
+    def denoised_fullcs(self: "_FiltGraph") -> vs.VideoNode:
+        return self.contrasharped[1]
+
+    @cached_property
+    def denoised(self: "_FiltGraph") -> vs.VideoNode:
+        fset = self.fset
+
+        if fset.dn_mode is None:
+            return self.clip16
+        if not fset.cs_mode:
+            return self.denoised_uv
+
+        denoised_expr = self.contrasharped[0]
+        if not fset.cs_merge:
+            return denoised_expr
+
+        cs_mask_merge = self.cs_mask.std.Inflate() if fset.cs_merge == 2 else self.cs_mask
+        return masked_merge(self.denoised_uv, denoised_expr, mask=cs_mask_merge, yuv=True)
+
+    @cached_property
+    def gradfun_src(self: "_FiltGraph") -> vs.VideoNode:
+        gradfun_srcs = {
+            1: "denoised_fullcs",
+            2: "denoised",  # default
+            3: "denoised_pref",
+            4: "full_denoise",
+        }
+        return getattr(self, gradfun_srcs[self.fset.db_gf_mode])
+
+    @cached_property
+    def db_mask_gradfun(self: "_FiltGraph") -> vs.VideoNode:
+        fset = self.fset
+        return gradfun_mask(source=self.gradfun_src, thr_det=fset.db_thr, mode=fset.db_mode)
+
+    @cached_property
+    def db_mask(self: "_FiltGraph") -> vs.VideoNode:
+        fset = self.fset
+        db_mask = self.db_mask_gradfun
 
         if fset.db_adaptive:
             db_mask = adaptive_debandmask(
-                clip=clip16,
-                source=gradfun_src,
+                clip=self.clip16,
+                source=self.gradfun_src,
                 db_mask=db_mask,
                 yaml=fset.db_adaptive,
                 db_expr=fset.db_expr,
             )
 
-        if fset.db_saveblack == 1:
-            debanded = save_black(clip=denoised, filtered=debanded, threshold=0.06276)
-        elif fset.db_saveblack == 2:
+        if fset.db_saveblack == 2:
             black_mask = rfs_color(
-                mask_src=mrgc,
+                mask_src=self.mrgc,
                 out_mask=True,
                 tolerance=fset.db_saveblack_tolerance,
             )
             db_mask = masked_merge(db_mask, black_mask, mask=black_mask, yuv=False)
 
-        debanded = masked_merge(debanded, denoised, mask=db_mask, yuv=fset.db_yuv)
+        return db_mask
 
-    # final masked_merge
-    if fset.dn_mode is None:
-        filtered = debanded
-    else:
-        if fset.db_rt_mode == 1:
-            rt_mask_afterdb = rt_mask_clip16
-        elif fset.db_rt_mode == 2:  # default
-            rt_mask_afterdb = rt_mask_mix
-        elif fset.db_rt_mode == 3:
-            rt_mask_afterdb = rt_mask_denoised
-        elif fset.db_rt_mode == 4:
-            rt_mask_afterdb = rt_mask_denoised_mix
-        elif fset.db_rt_mode == 5:
-            rt_mask_afterdb = rt_mask_denoised_x2
-
-        if fset.db_pref:
-            filtered = masked_merge(debanded, denoised, mask=rt_mask_afterdb, yuv=fset.db_yuv)
-        else:
-            filtered = masked_merge(debanded, clip16, mask=rt_mask_afterdb, yuv=fset.db_yuv)
-
-    # adaptive_grain
-    if out_mode == 1:
-        ag_mask = kg.adaptive_grain(filtered, luma_scaling=fset.ag_scaling, show_mask=True)
-    if fset.ag_str != 0:
-        grained = kg.adaptive_grain(filtered, luma_scaling=fset.ag_scaling, strength=fset.ag_str)
+    @cached_property
+    def debanded(self: "_FiltGraph") -> vs.VideoNode:
+        fset = self.fset
+
+        if fset.db_thr == 0:
+            return self.denoised
+
+        debanded = f3kdb_deband(
+            clip=self.denoised,
+            det_y=fset.db_det,
+            grainy=fset.db_grain,
+            drange=fset.db_range,
+            yuv=fset.db_yuv,
+        )
+        if fset.db_saveblack == 1:
+            debanded = save_black(clip=self.denoised, filtered=debanded, threshold=0.06276)
+
+        return masked_merge(debanded, self.denoised, mask=self.db_mask, yuv=fset.db_yuv)
+
+    @cached_property
+    def rt_mask_afterdb(self: "_FiltGraph") -> vs.VideoNode:
+        rt_masks = {
+            1: "rt_mask_clip16",
+            2: "rt_mask_mix",  # default
+            3: "rt_mask_denoised",
+            4: "rt_mask_denoised_mix",
+            5: "rt_mask_denoised_x2",
+        }
+        return getattr(self, rt_masks[self.fset.db_rt_mode])
+
+    @cached_property
+    def merged(self: "_FiltGraph") -> vs.VideoNode:
+        fset = self.fset
+
+        if fset.dn_mode is None:
+            return self.debanded
+
+        return masked_merge(
+            self.debanded,
+            self.denoised if fset.db_pref else self.clip16,
+            mask=self.rt_mask_afterdb,
+            yuv=fset.db_yuv,
+        )
+
+    @cached_property
+    def ag_mask(self: "_FiltGraph") -> vs.VideoNode:
+        return kg.adaptive_grain(self.merged, luma_scaling=self.fset.ag_scaling, show_mask=True)
+
+    @cached_property
+    def filtered(self: "_FiltGraph") -> vs.VideoNode:
+        fset = self.fset
+
+        if fset.ag_str == 0:
+            return self.merged
+
+        grained = kg.adaptive_grain(
+            self.merged,
+            luma_scaling=fset.ag_scaling,
+            strength=fset.ag_str,
+        )
 
         if fset.ag_saveblack == 1:
-            filtered = save_black(filtered, grained, threshold=0.06276)
-        elif fset.ag_saveblack == 2:
-            filtered = rfs_color(
+            return save_black(self.merged, grained, threshold=0.06276)
+        if fset.ag_saveblack == 2:
+            return rfs_color(
                 f1=grained,
-                f2=filtered,
-                mask_src=mrgc,
+                f2=self.merged,
+                mask_src=self.mrgc,
                 tolerance=fset.ag_saveblack_tolerance,
             )
-        else:
-            filtered = grained
-
-    if out_mode == 0:
-        return filtered
-    if out_mode == 1:
-        return _out_mask(ag_mask)
-    if out_mode == 2:
-        return _out_mask(db_mask_gradfun)
-    if out_mode == 3:
-        return _out_mask(db_mask)
-    if out_mode == 4:
-        return _out_mask(rt_mask_clip16)
-    if out_mode == 5:
-        return _out_mask(rt_mask_mix)
-    if out_mode == 6:
-        return _out_mask(rt_mask_denoised)
-    if out_mode == 7:
-        return _out_mask(rt_mask_denoised_x2)
 
-    return None
+        return grained
+
+    def output(self: "_FiltGraph", out_mode: int) -> vs.VideoNode:
+        """Build only the node requested by `out_mode`."""
+        if out_mode == 0:
+            return self.filtered
+        if out_mode not in _FILT_OUT_MASKS:
+            return None
+
+        return _out_mask(getattr(self, _FILT_OUT_MASKS[out_mode]))
+
+
+def _filt_graph(
+    mrgc: vs.VideoNode,
+    zone: str,
+    prefilt_func: VideoFunc | None,
+    override: dict[str, Any],
+) -> _FiltGraph:
+    fset = FilterSettings()
+    fset = override_dc(fset, block="filt", zone=zone, **override)
+
+    clip16 = depth(mrgc, PROC_DEPTH)
+
+    if prefilt_func:
+        clip16 = prefilt_func(mrgc, clip16)
+
+    return _FiltGraph(mrgc=mrgc, clip16=clip16, fset=fset)
+
+
+def filt(
+    mrgc: vs.VideoNode,
+    zone: str = "",
+    out_mode: int = 0,
+    prefilt_func: VideoFunc | None = None,
+    **override: Any,
+) -> vs.VideoNode:
+    """Apply various filters and denoising techniques to the input video clip.
+
+    Args:
+        mrgc: The input video clip.
+        zone: The zone to apply the filters to.
+        out_mode: The output mode.
+        prefilt_func: The pre-filter function.
+        **override: Additional parameters to override the default filter settings.
+
+    Returns:
+        The filtered video clip.
+    """
+    if out_mode != 0 and out_mode not in _FILT_OUT_MASKS:
+        return None
+
+    return _filt_graph(mrgc, zone, prefilt_func, override).output(out_mode)
+
+
+def filt_multi(
+    mrgc: vs.VideoNode,
+    out_modes: Iterable[int],
+    zone: str = "",
+    prefilt_func: VideoFunc | None = None,
+    **override: Any,
+) -> list[vs.VideoNode]:
+    """Same as `filt`, but returns several outputs built from one shared filter graph.
+
+    Args:
+        mrgc: The input video clip.
+        out_modes: The output modes to return, in order.
+        zone: The zone to apply the filters to.
+        prefilt_func: The pre-filter function.
+        **override: Additional parameters to override the default filter settings.
+
+    Returns:
+        One clip per requested output mode.
+    """
+    graph = _filt_graph(mrgc, zone, prefilt_func, override)
+
+    return [graph.output(out_mode) for out_mode in out_modes]
 
 
 #########
@@ -850,20 +1160,20 @@ def filt(  # noqa: PLR0911, PLR0912, PLR0915, C901
 
 
 def chapt(epname: str, chaptname: str, fallback: str = "") -> int | None:
-    chapters = load_yaml("./chapters.yaml")
+    chapters = _load_yaml("./chapters.yaml")
 
     if chapters is None:
         return None
 
     epchaps = chapters[epname]
 
-    return epchaps.get(chaptname, epchaps.get(fallback))
+    return deepcopy(epchaps.get(chaptname, epchaps.get(fallback)))
 
 
 def load_map(epname: str, mapname: str) -> Any:
-    maps = load_yaml("./maps.yaml")
+    maps = _load_yaml("./maps.yaml")
 
-    return None if maps is None else maps[mapname].get(epname)
+    return None if maps is None else deepcopy(maps[mapname].get(epname))
 
 
 def fname(file: str, aa_mode: bool = False) -> str:
@@ -897,7 +1207,7 @@ def source(
 
 
 def average(clips: list[vs.VideoNode]) -> vs.VideoNode:
-    min_num_frames = min(clip.num_frames for clip in clips)
+    min_num_frames = min(map(attrgetter("num_frames"), clips))
 
     return vs.core.average.Mean([clip.std.Trim(0, min_num_frames - 1) for clip in clips])
 
@@ -908,8 +1218,7 @@ def out(
     bits: int = 10,
     filtred: VideoFunc | None = None,
 ) -> vs.VideoNode:
-    if get_depth(clip) != bits:
-        clip = depth(clip, bits)
+    clip = depth(clip, bits)
 
     f1 = Path(f"./temp/{epname}_lossless.mp4")
 
@@ -932,34 +1241,23 @@ def pw(
     clip2_zone: str = "",
     ext_rip: vs.VideoNode | None = None,
 ) -> vs.VideoNode:
-    pw_list = []
-    if masks:
-        for out_mode in masks:
-            mask = filt(mrgc, zone=mask_zone, out_mode=out_mode)
-            pw_list.append(mask)
-
-    if epis:
-        pw_list.append(depth(epis, 10))
-    if clip:
-        pw_list.append(clip)
-    if clip2_zone:
-        pw_list.append(depth(filt(mrgc, zone=clip2_zone), 10))
-    if ext_rip:
-        pw_list.append(ext_rip)
-
-    return vs.core.std.Interleave(pw_list)
+    mask_clips = filt_multi(mrgc, out_modes=masks, zone=mask_zone) if masks else []
+
+    return vs.core.std.Interleave(
+        [
+            *mask_clips,
+            *([depth(epis, 10)] if epis else []),
+            *([clip] if clip else []),
+            *([depth(filt(mrgc, zone=clip2_zone), 10)] if clip2_zone else []),
+            *([ext_rip] if ext_rip else []),
+        ]
+    )
 
 
 def aa_pw(epis: vs.VideoNode, zones: Iterable[str] = ("main", "test")) -> vs.VideoNode:
-    pw_list = []
-    if epis:
-        pw_list.append(epis)
-
-    for zone in zones:
-        aaep = aa(epis, zone=zone)
-        pw_list.append(aaep)
+    aa_clips = [aa(epis, zone=zone) for zone in zones]
 
-    return vs.core.std.Interleave(pw_list)
+    return vs.core.std.Interleave([*([epis] if epis else []), *aa_clips])
 
 
 def masked_merge(
@@ -977,9 +1275,7 @@ def masked_merge(
 
 
 def check_num_frames(epis: vs.VideoNode, clip: vs.VideoNode) -> None:
-    if epis.num_frames != clip.num_frames:
-        msg = f"{epis.num_frames=}, {clip.num_frames=}"
-        raise NumFramesError(msg)
+    _check_num_frames(epis=epis, clip=clip)
 
 
 def _mask_resize(
@@ -995,14 +1291,38 @@ def _mask_resize(
     )
 
 
+def _black_mask(mask_src: vs.VideoNode, tolerance: int = 2) -> vs.VideoNode:
+    """GRAY16 mask of limited-range black pixels, built with a single Expr at the source depth."""
+    scale = 1 << (get_depth(mask_src) - 8)
+    black = 16 * scale
+    neutral = 128 * scale
+    tol = tolerance * scale
+
+    y = get_y(mask_src)
+    u, v = (plane(mask_src, n).resize.Point(y.width, y.height) for n in (1, 2))
+
+    return _expr(
+        [y, u, v],
+        f"x {black} - abs {tol} <= y {neutral} - abs {tol} <= and "
+        f"z {neutral} - abs {tol} <= and 65535 0 ?",
+        format=vs.GRAY16,
+    )
+
+
 def color_mask(
     mask_src: vs.VideoNode,
     format_src: vs.VideoNode,
     color: str = "$000000",
     tolerance: int = 2,
 ) -> vs.VideoNode:
-    if get_depth(mask_src) != 8:
-        mask_src = depth(mask_src, 8)
+    if (
+        color == "$000000"
+        and mask_src.format.color_family == vs.YUV
+        and mask_src.format.sample_type == vs.INTEGER
+    ):
+        return _black_mask(mask_src, tolerance=tolerance)
+
+    mask_src = depth(mask_src, 8)
 
     mask = mask_src.tcm.TColorMask(colors=color, tolerance=tolerance)
 
@@ -1075,6 +1395,7 @@ def diff_rescale_mask(source: vs.VideoNode, dset: AASettings) -> vs.VideoNode:
     from descale import Descale
     from fvsfunc import Resize
 
+    src_depth = get_depth(source)
     clip = get_y(source) if source.format.num_planes != 1 else source
 
     desc = Descale(
@@ -1094,27 +1415,19 @@ def diff_rescale_mask(source: vs.VideoNode, dset: AASettings) -> vs.VideoNode:
     )
     upsc = Resize(src=desc, w=source.width, h=source.height, **upsc_set)
 
-    if get_depth(source) != 8:
+    if src_depth != 8:
         clip = depth(clip, 8)
         upsc = depth(upsc, 8)
 
-    mask = (
-        vs.core.std.MakeDiff(clip, upsc)
-        .rgvs.RemoveGrain(2)
-        .rgvs.RemoveGrain(2)
-        .hist.Luma()
-        .std.Expr(f"x {dset.resc_mthr} < 0 x ?")
-        .std.Prewitt()
-        .std.Maximum()
-        .std.Maximum()
-        .std.Deflate()
-    )
+    diff = vs.core.std.MakeDiff(clip, upsc).rgvs.RemoveGrain(2).rgvs.RemoveGrain(2).hist.Luma()
+    edges = _expr(diff, f"x {dset.resc_mthr} < 0 x ?").std.Prewitt()
+    mask = _expand(edges, radius=2).std.Deflate()
 
     if dset.resc_expr:
-        mask = mask.std.Expr(dset.resc_expr)
+        mask = _expr(mask, dset.resc_expr)
 
-    if get_depth(mask) != (source_depth := get_depth(source)):
-        mask = depth(mask, source_depth)
+    if src_depth != 8:
+        mask = depth(mask, src_depth)
 
     return mask
 
@@ -1250,34 +1563,49 @@ def rfs_qtgmc(
     return replace_ranges(mrgc, stabilize, maps)
 
 
+_KIRSCH_KERNELS = (
+    [5, 5, 5, -3, 0, -3, -3, -3, -3],  # n
+    [5, 5, -3, 5, 0, -3, -3, -3, -3],  # nw
+    [5, -3, -3, 5, 0, -3, 5, -3, -3],  # w
+    [-3, -3, -3, 5, 0, -3, 5, 5, -3],  # sw
+    [-3, -3, -3, -3, 0, -3, 5, 5, 5],  # s
+    [-3, -3, -3, -3, 0, 5, -3, 5, 5],  # se
+    [-3, -3, 5, -3, 0, 5, -3, -3, 5],  # e
+    [-3, 5, 5, -3, 0, 5, -3, -3, -3],  # ne
+)
+"""Kirsch compass kernels, row-major 3x3."""
+
+_KIRSCH_MAX_EXPR = "x y max z max a max b max c max d max e max"
+"""Per-pixel max over the eight Kirsch convolutions."""
+
+
+@cache
+def _kirsch_expr() -> str:
+    """All eight Kirsch directions and their max as one akarin expression."""
+    directions = []
+    for kernel in _KIRSCH_KERNELS:
+        terms = [
+            f"x[{i % 3 - 1},{i // 3 - 1}]:m {weight} *"
+            for i, weight in enumerate(kernel)
+            if weight
+        ]
+        directions.append(" ".join(terms) + " +" * (len(terms) - 1) + " abs 3 /")
+
+    return " ".join(directions) + " max" * (len(directions) - 1)
+
+
 def get_kirsch2_mask(clip_y: vs.VideoNode) -> vs.VideoNode:
-    n = vs.core.std.Convolution(
-        clip_y, [5, 5, 5, -3, 0, -3, -3, -3, -3], divisor=3, saturate=False
-    )
-    nw = vs.core.std.Convolution(
-        clip_y, [5, 5, -3, 5, 0, -3, -3, -3, -3], divisor=3, saturate=False
-    )
-    w = vs.core.std.Convolution(
-        clip_y, [5, -3, -3, 5, 0, -3, 5, -3, -3], divisor=3, saturate=False
-    )
-    sw = vs.core.std.Convolution(
-        clip_y, [-3, -3, -3, 5, 0, -3, 5, 5, -3], divisor=3, saturate=False
-    )
-    s = vs.core.std.Convolution(
-        clip_y, [-3, -3, -3, -3, 0, -3, 5, 5, 5], divisor=3, saturate=False
-    )
-    se = vs.core.std.Convolution(
-        clip_y, [-3, -3, -3, -3, 0, 5, -3, 5, 5], divisor=3, saturate=False
-    )
-    e = vs.core.std.Convolution(
-        clip_y, [-3, -3, 5, -3, 0, 5, -3, -3, 5], divisor=3, saturate=False
-    )
-    ne = vs.core.std.Convolution(
-        clip_y, [-3, 5, 5, -3, 0, 5, -3, -3, -3], divisor=3, saturate=False
+    if hasattr(vs.core, "akarin"):
+        # single pass over the 3x3 neighbourhood instead of 8 convolutions + Expr
+        return vs.core.akarin.Expr(clip_y, _kirsch_expr())
+
+    n, nw, w, sw, s, se, e, ne = (
+        vs.core.std.Convolution(clip_y, kernel, divisor=3, saturate=False)
+        for kernel in _KIRSCH_KERNELS
     )
-    return vs.core.std.Expr(
+    return _expr(
         [n, nw, w, sw, s, se, e, ne],
-        ["x y max z max a max b max c max d max e max"],
+        [_KIRSCH_MAX_EXPR],
     )
 
 
@@ -1293,7 +1621,7 @@ def edge_detect(clip: vs.VideoNode, mode: str, expr: str = "") -> vs.VideoNode:
     elif mode == "sobel":
         mask = vs.core.std.Sobel(clip_y)
 
-    return mask.std.Expr(expr) if expr else mask
+    return _expr(mask, expr) if expr else mask
 
 
 def outerline_mask(
@@ -1305,11 +1633,10 @@ def outerline_mask(
 ) -> vs.VideoNode:
     mask = ext_mask or edge_detect(clip, mode=mode)
 
-    mask_outer = iterate(mask, function=vs.core.std.Maximum, count=max_c)
-    mask_inner = mask.std.Inflate()
-    mask_inner = iterate(mask_inner, function=vs.core.std.Minimum, count=min_c)
+    mask_outer = _expand(mask, radius=max_c)
+    mask_inner = _inpand(mask.std.Inflate(), radius=min_c)
 
-    return vs.core.std.Expr([mask_outer, mask_inner], "x y -")
+    return _expr([mask_outer, mask_inner], "x y -")
 
 
 @dataclass(frozen=True)
@@ -1367,11 +1694,11 @@ def rfs_dehalo(
 
 
 def dehalo_chroma(clip: vs.VideoNode, zone: str = "") -> vs.VideoNode:
-    planes = split(clip)
-    planes[1] = rfs_dehalo(planes[1], zone=zone)
-    planes[2] = rfs_dehalo(planes[2], zone=zone)
-
-    return join(planes)
+    return _replace_chroma(
+        clip,
+        rfs_dehalo(plane(clip, 1), zone=zone),
+        rfs_dehalo(plane(clip, 2), zone=zone),
+    )
 
 
 @dataclass(frozen=True)
@@ -1489,6 +1816,15 @@ class EdgeFixSettings:
         )
 
 
+def _continuity(clip: vs.VideoNode, **sides: int | list[int]) -> vs.VideoNode:
+    """Apply `edgefixer.Continuity`, or return the clip as is when no edge is set."""
+    edges = (sides.get(key, 0) for key in ("top", "bottom", "left", "right"))
+    if not any(any(val) if isinstance(val, list) else val for val in edges):
+        return clip
+
+    return clip.edgefixer.Continuity(**sides)
+
+
 def edgefix(
     epis: vs.VideoNode,
     zone: str = "",
@@ -1499,7 +1835,7 @@ def edgefix(
     def _edgefixer(epis: vs.VideoNode) -> vs.VideoNode:
         if not edset.yuv or not edset.crop_args:
             # luma
-            return vs.core.edgefixer.Continuity(
+            return _continuity(
                 epis,
                 top=edset.top,
                 bottom=edset.bottom,
@@ -1515,45 +1851,24 @@ def edgefix(
         right = edset.to_list(edset.right)
         radius = edset.to_list(edset.radius)
 
+        # independent per-plane chains, planes without edges to fix are passed through
         planes = split(epis)
-
-        y = (
-            planes[0]
-            .std.Crop(**edset.crop_args)
-            .edgefixer.Continuity(
-                top=top[0],
-                bottom=bottom[0],
-                left=left[0],
-                right=right[0],
-                radius=radius[0],
+        fixed = [
+            _continuity(
+                clip,
+                top=top[n],
+                bottom=bottom[n],
+                left=left[n],
+                right=right[n],
+                radius=radius[n],
             )
-            .std.AddBorders(**edset.crop_args)
-            if edset.crop_args
-            else planes[0].edgefixer.Continuity(
-                top=top[0],
-                bottom=bottom[0],
-                left=left[0],
-                right=right[0],
-                radius=radius[0],
+            for n, clip in enumerate(
+                [planes[0].std.Crop(**edset.crop_args), planes[1], planes[2]],
             )
-        )
-
-        u = planes[1].edgefixer.Continuity(
-            top=top[1],
-            bottom=bottom[1],
-            left=left[1],
-            right=right[1],
-            radius=radius[1],
-        )
-        v = planes[2].edgefixer.Continuity(
-            top=top[2],
-            bottom=bottom[2],
-            left=left[2],
-            right=right[2],
-            radius=radius[2],
-        )
+        ]
+        y = fixed[0].std.AddBorders(**edset.crop_args)
 
-        return join([y, u, v])
+        return join([y, fixed[1], fixed[2]])
 
     edset = EdgeFixSettings()
     edset = override_dc(edset, block="edgefix", zone=zone, **override)
@@ -1566,11 +1881,7 @@ def edgefix(
 
 
 def wipe_luma_row(clip: vs.VideoNode, **crop: Any) -> vs.VideoNode:
-    planes = split(clip)
-
-    planes[0] = planes[0].std.Crop(**crop).std.AddBorders(**crop)
-
-    return join(planes)
+    return _replace_plane(clip, get_y(clip).std.Crop(**crop).std.AddBorders(**crop), 0)
 
 
 @dataclass(frozen=True)
@@ -1634,7 +1945,7 @@ def to60fps_mv(clip: vs.VideoNode) -> vs.VideoNode:
 
 
 def to60fps_svp(clip: vs.VideoNode) -> vs.VideoNode:
-    clip_p8 = depth(clip, 8) if get_depth(clip) != 8 else clip
+    clip_p8 = depth(clip, 8)
 
     super_params = "{gpu: 1, pel: 2}"
     analyse_params = "{gpu: 1, block: {w:8, overlap:3}, refine: [{thsad:1000, search:{type:3}}]}"
@@ -1668,36 +1979,67 @@ def chromashift(clip: vs.VideoNode, cx: int = 0, cy: int = 0) -> vs.VideoNode:
     cx — Horizontal chroma shift. Positive value shifts chroma to left, negative value shifts chroma to right.
     cy — Vertical chroma shift. Positive value shifts chroma upwards, negative value shifts chroma downwards.
     """
-    planes = split(clip)
+    return _replace_chroma(
+        clip,
+        vs.core.resize.Spline36(plane(clip, 1), src_left=cx, src_top=cy),
+        vs.core.resize.Spline36(plane(clip, 2), src_left=cx, src_top=cy),
+    )
 
-    planes[1] = vs.core.resize.Spline36(planes[1], src_left=cx, src_top=cy)
-    planes[2] = vs.core.resize.Spline36(planes[2], src_left=cx, src_top=cy)
 
-    return join(planes)
+def _chromashift_select_expr() -> str:
+    """`akarin.Select` index (0 - clip, 1 - fix) for the `adaptive_chromashift` prop_src layout."""
 
+    def _stat_gt(fix_idx: int, def_idx: int) -> str:
+        return f"src{fix_idx}.PlaneStatsAverage src{def_idx}.PlaneStatsAverage >"
+
+    c0 = _stat_gt(1, 0)
+    p1, n1 = _stat_gt(3, 2), _stat_gt(5, 4)
+    p2, n2 = _stat_gt(7, 6), _stat_gt(9, 8)
+    p3, n3 = _stat_gt(11, 10), _stat_gt(13, 12)
+
+    return f"{p1} {n1} = {p1} {p2} {n2} = {p2} {p3} {n3} = {p3} {c0} ? ? ?"
+
+
+def _sobel(clip: vs.VideoNode, opencl: bool = False) -> vs.VideoNode:
+    """Sobel with `std.Sobel`, or on the GPU with `tcanny.TCannyCL` when `opencl` is set.
+
+    TCannyCL does not scale and round like `std.Sobel`, so the results differ slightly.
+    """
+    if opencl:
+        # sigma=0 skips the gaussian blur, mode=1 returns the gradient magnitude, op=2 is Sobel
+        device = get_edi3_mode().device
+        return vs.core.tcanny.TCannyCL(clip, sigma=0, mode=1, op=2, device=device)
+
+    return vs.core.std.Sobel(clip)
 
-def adaptive_chromashift(  # noqa: PLR0915
-    clip: vs.VideoNode,
-    fix: vs.VideoNode,
-    pw_mode: int = 0,
-) -> vs.VideoNode:
-    """Chromashift with comparisons for floating chromashift."""
 
-    def make_diff(clip: vs.VideoNode) -> vs.VideoNode:
-        from fvsfunc import Downscale444
+def _chromashift_stats(clip: vs.VideoNode, opencl: bool = False) -> vs.VideoNode:
+    """PlaneStats of the luma/chroma edge difference compared by `adaptive_chromashift`."""
+    from fvsfunc import Downscale444
+
+    desc_h = 720
+    desc_w = hav.m4((clip.width * desc_h) / clip.height)
+    descale = Downscale444(clip, w=desc_w, h=desc_h)
 
-        desc_h = 720
-        desc_w = hav.m4((clip.width * desc_h) / clip.height)
-        descale = Downscale444(clip, w=desc_w, h=desc_h)
+    # one Sobel over all planes, then MakeDiff(y, max(u, v)) in a single Expr
+    edges = split(_sobel(descale, opencl=opencl))
+    fmt = descale.format
+    neutral = "" if fmt.sample_type == vs.FLOAT else f" {1 << (fmt.bits_per_sample - 1)} +"
 
-        planes_desc = split(descale)
-        y = vs.core.std.Sobel(planes_desc[0])
-        u = vs.core.std.Sobel(planes_desc[1])
-        v = vs.core.std.Sobel(planes_desc[2])
+    return vs.core.std.PlaneStats(_expr(edges, f"x y z max -{neutral}"))
 
-        uv = vs.core.std.Expr([u, v], ["x y max"])
 
-        return vs.core.std.MakeDiff(y, uv)
+def adaptive_chromashift(
+    clip: vs.VideoNode,
+    fix: vs.VideoNode,
+    pw_mode: int = 0,
+    opencl: bool = False,
+) -> vs.VideoNode:
+    """Chromashift with comparisons for floating chromashift.
+
+    `opencl` computes the Sobel edges with `tcanny.TCannyCL`, which may pick slightly different
+    shifts than the default `std.Sobel`.
+    """
 
     def frame_diff_eval(
         n: int,
@@ -1705,22 +2047,13 @@ def adaptive_chromashift(  # noqa: PLR0915
         f1: vs.VideoNode,
         f2: vs.VideoNode,
     ) -> vs.VideoNode:
-        c0 = f[1].props.PlaneStatsAverage > f[0].props.PlaneStatsAverage
-        p1 = f[3].props.PlaneStatsAverage > f[2].props.PlaneStatsAverage
-        n1 = f[5].props.PlaneStatsAverage > f[4].props.PlaneStatsAverage
-        p2 = f[7].props.PlaneStatsAverage > f[6].props.PlaneStatsAverage
-        n2 = f[9].props.PlaneStatsAverage > f[8].props.PlaneStatsAverage
-        p3 = f[11].props.PlaneStatsAverage > f[10].props.PlaneStatsAverage
-        n3 = f[13].props.PlaneStatsAverage > f[12].props.PlaneStatsAverage
-
-        if p1 == n1:
-            condition = p1 and n1
-        elif p2 == n2:
-            condition = p2 and n2
-        elif p3 == n3:
-            condition = p3 and n3
-        else:
-            condition = c0
+        avg = [frame.props.PlaneStatsAverage for frame in f]
+        # fix > clip for curr0, prev1, next1, prev2, next2, prev3, next3
+        c0, p1, n1, p2, n2, p3, n3 = map(gt, avg[1::2], avg[::2])
+
+        # the nearest prev/next pair that agrees decides, curr0 otherwise
+        pairs = ((p1, n1), (p2, n2), (p3, n3))
+        condition = next((prev for prev, nxt in pairs if prev == nxt), c0)
 
         out = f2 if condition else f1
 
@@ -1746,28 +2079,32 @@ def adaptive_chromashift(  # noqa: PLR0915
         return out.sub.Subtitle("\n".join(lines), start=n, end=n + 1, style=style)
 
     def _adaptive_chromashift(clip: vs.VideoNode, fix: vs.VideoNode) -> vs.VideoNode:
-        diff_def = make_diff(clip)
-        diff_fix = make_diff(fix)
-
-        s0 = vs.core.std.PlaneStats(diff_def)  # curr0
-        s1 = vs.core.std.PlaneStats(diff_fix)  # curr0
-        s2 = vs.core.std.PlaneStats(diff_def).std.DuplicateFrames(0)  # prev1
-        s3 = vs.core.std.PlaneStats(diff_fix).std.DuplicateFrames(0)  # prev1
-        s4 = vs.core.std.PlaneStats(diff_def).std.Trim(1)  # next1
-        s5 = vs.core.std.PlaneStats(diff_fix).std.Trim(1)  # next1
-        s6 = vs.core.std.PlaneStats(diff_def).std.DuplicateFrames([0, 1])  # prev2
-        s7 = vs.core.std.PlaneStats(diff_fix).std.DuplicateFrames([0, 1])  # prev2
-        s8 = vs.core.std.PlaneStats(diff_def).std.Trim(2)  # next2
-        s9 = vs.core.std.PlaneStats(diff_fix).std.Trim(2)  # next2
-        s10 = vs.core.std.PlaneStats(diff_def).std.DuplicateFrames([0, 1, 2])  # prev3
-        s11 = vs.core.std.PlaneStats(diff_fix).std.DuplicateFrames([0, 1, 2])  # prev3
-        s12 = vs.core.std.PlaneStats(diff_def).std.Trim(3)  # next3
-        s13 = vs.core.std.PlaneStats(diff_fix).std.Trim(3)  # next3
+        # one PlaneStats per clip, the shifted copies carry its props
+        s0 = _chromashift_stats(clip, opencl=opencl)  # curr0
+        s1 = _chromashift_stats(fix, opencl=opencl)  # curr0
+        s2 = s0.std.DuplicateFrames(0)  # prev1
+        s3 = s1.std.DuplicateFrames(0)  # prev1
+        s4 = s0.std.Trim(1)  # next1
+        s5 = s1.std.Trim(1)  # next1
+        s6 = s0.std.DuplicateFrames([0, 1])  # prev2
+        s7 = s1.std.DuplicateFrames([0, 1])  # prev2
+        s8 = s0.std.Trim(2)  # next2
+        s9 = s1.std.Trim(2)  # next2
+        s10 = s0.std.DuplicateFrames([0, 1, 2])  # prev3
+        s11 = s1.std.DuplicateFrames([0, 1, 2])  # prev3
+        s12 = s0.std.Trim(3)  # next3
+        s13 = s1.std.Trim(3)  # next3
+
+        prop_src = [s0, s1, s2, s3, s4, s5, s6, s7, s8, s9, s10, s11, s12, s13]
+
+        if not pw_mode and hasattr(vs.core, "akarin"):
+            # same decision as frame_diff_eval, evaluated without a python callback
+            return vs.core.akarin.Select([clip, fix], prop_src, _chromashift_select_expr())
 
         return vs.core.std.FrameEval(
             clip=clip,
             eval=partial(frame_diff_eval, f1=clip, f2=fix),
-            prop_src=[s0, s1, s2, s3, s4, s5, s6, s7, s8, s9, s10, s11, s12, s13],
+            prop_src=prop_src,
         )
 
     return _adaptive_chromashift(clip, fix)
@@ -1825,23 +2162,37 @@ def rescale_(
     return None
 
 
-def downscale(clip: vs.VideoNode, desc_h: int = 720, to420: bool = False) -> vs.VideoNode:
-    """Downcale clip to the new size."""
+def downscale(
+    clip: vs.VideoNode,
+    desc_h: int = 720,
+    to420: bool = False,
+    fast: bool = False,
+) -> vs.VideoNode:
+    """Downcale clip to the new size.
+
+    With `fast`, integer ratio downscales use Bilinear instead of Spline36 (softer, but cheaper).
+    """
     if clip.height == desc_h:
         return clip
 
     desc_w = hav.m4((clip.width * desc_h) / clip.height)
 
-    if not to420:
-        return clip.resize.Spline36(desc_w, desc_h)
-
-    planes = split(clip)
+    resize = vs.core.resize.Spline36
+    if fast and clip.height % desc_h == 0 and clip.width % desc_w == 0:
+        resize = vs.core.resize.Bilinear
 
-    planes[0] = planes[0].resize.Spline36(desc_w, desc_h)
-    planes[1] = planes[1].resize.Spline36(desc_w / 2, desc_h / 2)
-    planes[2] = planes[2].resize.Spline36(desc_w / 2, desc_h / 2)
+    if not to420:
+        return resize(clip, desc_w, desc_h)
 
-    return join(planes)
+    # center chroma siting on both ends matches resizing each plane on its own
+    return resize(
+        clip,
+        desc_w,
+        desc_h,
+        format=clip.format.replace(subsampling_w=1, subsampling_h=1),
+        chromaloc_in_s="center",
+        chromaloc_s="center",
+    )
 
 
 def rfs_black_crop(
@@ -1856,15 +2207,19 @@ def rfs_black_crop(
 
 
 def get_list(ranges: list[FrameRange]) -> list[int]:
-    frames = []
-    for x in ranges:
-        if isinstance(x, tuple):
-            start, end = x
-            frames.extend(list(range(start, end + 1)))
-        elif isinstance(x, int):
-            frames.append(x)
+    import numpy as np
 
-    return frames
+    spans = [x if isinstance(x, tuple) else (x, x) for x in ranges if isinstance(x, tuple | int)]
+    if not spans:
+        return []
+
+    starts, ends = np.array(spans, dtype=np.int64).T
+    lengths = np.maximum(ends - starts + 1, 0)
+
+    # arange over the total length, shifted per span so that each span starts at its own start
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+    return (np.arange(lengths.sum()) + offsets).tolist()
 
 
 def pv_diff(
@@ -1895,15 +2250,11 @@ def pv_diff(
     comparison, frames = diff(clips[0], clips[1], thr=thr, return_ranges=True)
 
     if exclude_ranges:
-        frames = [x for x in frames if x not in get_list(exclude_ranges)]
+        excluded = set(get_list(exclude_ranges))
+        frames = [x for x in frames if x not in excluded]
 
+    entry = f"{frames!r} \n\n" if frames else "no differences found"
     with Path("./diff.txt").open("a") as log:
-        if name:
-            log.write(f"{name}=")
-
-        if frames:
-            log.write(f"{frames!r} \n\n")
-        else:
-            log.write("no differences found")
+        log.write(f"{name}={entry}" if name else entry)
 
     return comparison
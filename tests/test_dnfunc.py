@@ -1,5 +1,192 @@
-from dnfunc import NumFramesError
+import operator
+import os
+import random
+import re
+
+from dnfunc import AASettings, NumFramesError, get_list, load_yaml, override_dc
+from dnfunc.dnfunc import _chromashift_select_expr, _kirsch_expr
+
+_BINARY_OPS = {
+    "+": operator.add,
+    "*": operator.mul,
+    "/": operator.truediv,
+    ">": operator.gt,
+    "=": operator.eq,
+    "max": max,
+}
+
+
+def _rpn(expr, load):
+    """Evaluate the subset of akarin expression syntax used by the expression builders."""
+    stack = []
+    for token in expr.split():
+        if token in _BINARY_OPS:
+            b, a = stack.pop(), stack.pop()
+            stack.append(_BINARY_OPS[token](a, b))
+        elif token == "abs":
+            stack.append(abs(stack.pop()))
+        elif token == "?":
+            no, yes, cond = stack.pop(), stack.pop(), stack.pop()
+            stack.append(yes if cond else no)
+        else:
+            stack.append(load(token))
+
+    (result,) = stack
+    return result
+
+
+def _pixel_loader(img, px, py):
+    height, width = len(img), len(img[0])
+
+    def load(token):
+        if m := re.fullmatch(r"x\[(-?\d+),(-?\d+)\](:m)?", token):
+            x = min(max(px + int(m[1]), 0), width - 1)
+            y = min(max(py + int(m[2]), 0), height - 1)
+            return img[y][x]
+        return float(token)
+
+    return load
+
+
+def _prop_loader(stats):
+    def load(token):
+        # srcN.PlaneStatsAverage
+        return stats[int(token.removeprefix("src").split(".")[0])]
+
+    return load
+
+
+def _random_image(rng, width=9, height=7):
+    return [[rng.randrange(256) for _ in range(width)] for _ in range(height)]
 
 
 def test_numframeserror():
     assert issubclass(NumFramesError, Exception)
+
+
+def test_load_yaml_reloads_on_change(tmp_path):
+    settings = tmp_path / "settings.yaml"
+    settings.write_text("aa:\n  main:\n    desc_h: 720\n")
+    assert load_yaml(str(settings)) == {"aa": {"main": {"desc_h": 720}}}
+
+    # size changes
+    settings.write_text("aa:\n  main:\n    desc_h: 1080\n")
+    assert load_yaml(str(settings)) == {"aa": {"main": {"desc_h": 1080}}}
+
+    # same size, newer mtime
+    mtime_ns = settings.stat().st_mtime_ns
+    settings.write_text("aa:\n  main:\n    desc_h: 1000\n")
+    os.utime(settings, ns=(mtime_ns + 10**9, mtime_ns + 10**9))
+    assert load_yaml(str(settings)) == {"aa": {"main": {"desc_h": 1000}}}
+
+
+def test_load_yaml_returns_copy(tmp_path):
+    settings = tmp_path / "settings.yaml"
+    settings.write_text("aa:\n  main:\n    desc_h: 720\n")
+
+    load_yaml(str(settings))["aa"]["main"]["desc_h"] = 1
+    assert load_yaml(str(settings)) == {"aa": {"main": {"desc_h": 720}}}
+
+
+def test_load_yaml_missing_file(tmp_path):
+    assert load_yaml(str(tmp_path / "missing.yaml")) is None
+
+
+def test_get_list():
+    assert get_list([]) == []
+    assert get_list([5]) == [5]
+    assert get_list([(3, 3)]) == [3]
+    assert get_list([(0, 2), 7, (10, 12)]) == [0, 1, 2, 7, 10, 11, 12]
+    # reversed ranges expand to nothing, like range()
+    assert get_list([(5, 3), 1]) == [1]
+
+
+def test_get_list_matches_range_expansion():
+    rng = random.Random(0)
+    for _ in range(100):
+        ranges = [
+            rng.randrange(50) if rng.random() < 0.3 else (rng.randrange(50), rng.randrange(50))
+            for _ in range(rng.randrange(6))
+        ]
+        expected = []
+        for x in ranges:
+            expected.extend(range(x[0], x[1] + 1) if isinstance(x, tuple) else [x])
+        assert get_list(ranges) == expected
+
+
+def test_override_dc(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    settings = tmp_path / "settings.yaml"
+    settings.write_text("aa:\n  main:\n    desc_h: 720\n  z1:\n    desc_h: 810\n")
+
+    aaset = override_dc(AASettings(), block="aa", zone="z1", nrad=3)
+    assert (aaset.desc_h, aaset.nrad) == (810, 3)
+    assert override_dc(AASettings(), block="aa", zone="z1", nrad=3) is aaset
+    assert override_dc(AASettings(), block="aa", nrad=3).desc_h == 720
+
+    # a changed yaml invalidates the cached result
+    mtime_ns = settings.stat().st_mtime_ns
+    settings.write_text("aa:\n  main:\n    desc_h: 720\n  z1:\n    desc_h: 900\n")
+    os.utime(settings, ns=(mtime_ns + 10**9, mtime_ns + 10**9))
+    assert override_dc(AASettings(), block="aa", zone="z1", nrad=3).desc_h == 900
+
+    # no yaml: defaults and overrides only
+    settings.unlink()
+    assert override_dc(AASettings(), block="aa", zone="z1", nrad=3) == AASettings(nrad=3)
+    assert override_dc(AASettings(), block="aa") == AASettings()
+
+
+def test_kirsch_expr():
+    kernels = (
+        [5, 5, 5, -3, 0, -3, -3, -3, -3],
+        [5, 5, -3, 5, 0, -3, -3, -3, -3],
+        [5, -3, -3, 5, 0, -3, 5, -3, -3],
+        [-3, -3, -3, 5, 0, -3, 5, 5, -3],
+        [-3, -3, -3, -3, 0, -3, 5, 5, 5],
+        [-3, -3, -3, -3, 0, 5, -3, 5, 5],
+        [-3, -3, 5, -3, 0, 5, -3, -3, 5],
+        [-3, 5, 5, -3, 0, 5, -3, -3, -3],
+    )
+    img = _random_image(random.Random(0))
+    expr = _kirsch_expr()
+
+    for y in range(1, len(img) - 1):
+        for x in range(1, len(img[0]) - 1):
+            window = [img[y + i // 3 - 1][x + i % 3 - 1] for i in range(9)]
+            expected = max(abs(sum(map(operator.mul, k, window))) / 3 for k in kernels)
+            assert _rpn(expr, _pixel_loader(img, x, y)) == expected
+
+
+def test_chromashift_select_expr():
+    expr = _chromashift_select_expr()
+    rng = random.Random(0)
+
+    for _ in range(500):
+        stats = [rng.choice((0.1, 0.2, 0.3)) for _ in range(14)]
+        c0, p1, n1, p2, n2, p3, n3 = (stats[i + 1] > stats[i] for i in range(0, 14, 2))
+        if p1 == n1:
+            expected = p1
+        elif p2 == n2:
+            expected = p2
+        elif p3 == n3:
+            expected = p3
+        else:
+            expected = c0
+
+        result = _rpn(expr, _prop_loader(stats))
+        assert bool(result) == expected
+
+
+def test_load_yaml_keyed_by_directory(tmp_path, monkeypatch):
+    for name, desc_h in (("a", 720), ("b", 810)):
+        (tmp_path / name).mkdir()
+        settings = tmp_path / name / "settings.yaml"
+        settings.write_text(f"aa:\n  main:\n    desc_h: {desc_h}\n")
+        os.utime(settings, ns=(10**18, 10**18))
+
+    monkeypatch.chdir(tmp_path / "a")
+    assert load_yaml("./settings.yaml") == {"aa": {"main": {"desc_h": 720}}}
+
+    # same relative path, size and mtime in another directory
+    monkeypatch.chdir(tmp_path / "b")
+    assert load_yaml("./settings.yaml") == {"aa": {"main": {"desc_h": 810}}}